@@ -1,11 +1,87 @@
 import os
 import json
-from typing import Dict, List, Optional
+import sys
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson  # 可选：更快的 JSON 序列化，未安装时退回标准库 json
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+
+@lru_cache(maxsize=4096)
+def _pad_addr(addr: str, bits: int) -> str:
+    """地址补位（仅对 P 开头地址生效），按（地址, 补位数）缓存"""
+    if addr.upper().startswith("P"):
+        num_part = ''.join([c for c in addr if c.isdigit() or c == 'X'])
+        padded_num = num_part.zfill(len(num_part) + bits)
+        # 驻留补位后的地址字符串，内存索引表和动态地址元组共用同一个对象
+        return sys.intern(f"P{padded_num}")
+    return addr
+
+
+@lru_cache(maxsize=256)
+def _resolve_dyn(addr: str, bits: int) -> Tuple[str, ...]:
+    """展开动态地址为补位后地址元组（P001X → 10个地址），每个模板只展开一次"""
+    if "X" not in addr:
+        return (_pad_addr(addr.upper(), bits),)
+    return tuple(_pad_addr(addr.upper().replace("X", str(i)), bits) for i in range(10))
+
+
+# 预编译循环体的操作码
+OP_UPDATE_ADD = 0  # u -a：在当前值上累加偏移量
+OP_SET = 1  # s：直接赋值
+OP_INC = 2  # u CN：当前值+1
+
+
+def _solve_loop(opcodes: List[int], targets: List[str], deltas: List[int],
+                read: Callable[[str], int], term_key: str, term_val: int
+                ) -> Optional[Tuple[int, Dict[str, int]]]:
+    """闭式求解预编译循环体，返回 (循环次数, 各地址最终值)（循环不会终止时返回 None）"""
+    effect: Dict[str, Tuple[bool, int]] = {}  # 地址 → (本轮是否被赋常量, 常量值或每轮增量)
+    for op, target, delta in zip(opcodes, targets, deltas):
+        if op == OP_SET:
+            effect[target] = (True, delta)
+        else:  # OP_UPDATE_ADD / OP_INC（OP_INC 的 delta 恒为1）
+            is_set, val = effect.get(target, (False, 0))
+            effect[target] = (is_set, val + delta)
+
+    # 终止判断在每轮末尾进行，因此至少执行一轮
+    is_set, val = effect.get(term_key, (False, 0))
+    start = read(term_key)
+    if is_set:
+        if val < term_val:
+            return None
+        n = 1
+    elif start + val >= term_val:
+        n = 1
+    elif val > 0:
+        # 每轮增量固定为 val，第 n 轮末的值为 初值 + n*val，取满足 >= 终止常量的最小 n（向上取整）
+        n = -(-(term_val - start) // val)
+    else:
+        return None
+
+    # 被赋常量的地址 n 轮后仍为该常量，其余地址累加 n 倍增量
+    return n, {target: val if is_set else read(target) + val * n
+               for target, (is_set, val) in effect.items()}
+
 
 class PomPovEditor:
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
         # 内存管理：编辑器自建 P 开头内存（严格区分大小写，补位后地址统一为大写）
-        self.editor_memory: Dict[str, int] = {}
+        # 数值按下标存放在 _mem，_addr_to_idx 记录补位后地址→下标
+        self._mem: List[int] = []
+        self._addr_to_idx: Dict[str, int] = {}
         # 磁盘地址映射：C:/D:/ 开头对应系统合法路径
         self.disk_map = {
             "C:": os.path.join(os.getenv("LOCALAPPDATA", "."), "PomPovEditor", "C_drive"),
@@ -14,6 +90,30 @@ class PomPovEditor:
         self.cxba_bits = 2  # 补2位规则
         self.loop_running = False
         self.terminate_constant = 0
+        self.verbose = verbose  # 逐次打印循环过程（关闭时走预编译快速路径）
+        # 磁盘写回缓存：key=配置文件路径，value=数值；改动的文件记入 _dirty，关机时统一写回
+        self._disk_cache: Dict[str, int] = {}
+        self._dirty = set()
+        self._config_paths: Dict[str, str] = {}  # 磁盘地址 → 配置文件路径
+
+    @property
+    def editor_memory(self) -> Dict[str, int]:
+        """按需从内存数组重建 {补位后地址: 数值} 字典（兼容旧接口，返回快照）"""
+        mem = self._mem
+        return {addr: mem[idx] for addr, idx in self._addr_to_idx.items()}
+
+    def _mem_index(self, addr: str) -> int:
+        """获取补位后地址在内存数组中的下标（首次写入时分配）"""
+        idx = self._addr_to_idx.get(addr)
+        if idx is None:
+            idx = self._addr_to_idx[addr] = len(self._mem)
+            self._mem.append(0)
+        return idx
+
+    def _read_mem(self, addr: str) -> int:
+        """读取补位后地址的值（未写入过的地址为0，不分配下标）"""
+        idx = self._addr_to_idx.get(addr)
+        return 0 if idx is None else self._mem[idx]
 
     def _init_disk(self):
         for path in self.disk_map.values():
@@ -22,41 +122,41 @@ class PomPovEditor:
 
     def _pad_address(self, addr: str) -> str:
         """地址补2位（仅对 P 开头地址生效，统一转为大写）"""
-        if addr.upper().startswith("P"):
-            num_part = ''.join([c for c in addr if c.isdigit() or c == 'X'])
-            padded_num = num_part.zfill(len(num_part) + self.cxba_bits)
-            return f"P{padded_num}"
-        return addr
-
-    def _resolve_dynamic_addr(self, addr: str) -> List[str]:
-        """解析动态地址（P001X → P0010-P0019）"""
-        if "X" not in addr:
-            return [self._pad_address(addr.upper())]
-        return [self._pad_address(addr.upper().replace("X", str(i))) for i in range(10)]
+        return _pad_addr(addr, self.cxba_bits)
+
+    def _resolve_dynamic_addr(self, addr: str) -> Tuple[str, ...]:
+        """解析动态地址（P001X → P0010-P0019），展开结果按原始地址缓存"""
+        return _resolve_dyn(addr, self.cxba_bits)
 
     def _parse_operation(self, op_str: str) -> int:
-        """解析加减组合操作（pom=减1，pov=加1）"""
-        clean_op = op_str.replace("(", "").replace(")", "").replace("-", "").upper()
-        op_count = 0
-        for op in clean_op:
-            if op == "M":  # pom 标识
-                op_count -= 1
-            elif op == "V":  # pov 标识
-                op_count += 1
-        return op_count
+        """解析加减组合操作（pom=减1，pov=加1，不区分大小写）"""
+        return op_str.count("V") + op_str.count("v") - op_str.count("M") - op_str.count("m")
+
+    def _config_file(self, target: str) -> str:
+        """获取磁盘地址对应的配置文件路径（每个地址只拼接一次）"""
+        config_file = self._config_paths.get(target)
+        if config_file is None:
+            disk_path = self.disk_map[target.split(":")[0] + ":"]
+            config_file = os.path.join(disk_path, f"{target.replace(':', '_')}.json")
+            self._config_paths[target] = config_file
+        return config_file
 
     def _get_target_value(self, target: str) -> int:
         """获取目标地址的当前值（内存/磁盘）"""
         target = target.upper()
         if target.startswith("P"):
-            return self.editor_memory.get(self._pad_address(target), 0)
+            idx = self._addr_to_idx.get(self._pad_address(target))
+            return 0 if idx is None else self._mem[idx]
         elif target.startswith(("C:", "D:")):
-            disk_path = self.disk_map[target.split(":")[0] + ":"]
-            config_file = os.path.join(disk_path, f"{target.replace(':', '_')}.json")
-            if os.path.exists(config_file):
-                with open(config_file, "r") as f:
-                    return json.load(f).get("value", 0)
-            return 0
+            config_file = self._config_file(target)
+            if config_file not in self._disk_cache:
+                try:
+                    with open(config_file, "rb") as f:
+                        value = _json_loads(f.read()).get("value", 0)
+                except FileNotFoundError:
+                    value = 0
+                self._disk_cache[config_file] = value
+            return self._disk_cache[config_file]
         else:
             raise ValueError(f"不支持的地址类型：{target}")
 
@@ -68,12 +168,19 @@ class PomPovEditor:
         final_val = value if not is_update else current_val + value
 
         if target_padded.startswith("P"):
-            self.editor_memory[target_padded] = final_val
+            self._mem[self._mem_index(target_padded)] = final_val
         elif target_padded.startswith(("C:", "D:")):
-            disk_path = self.disk_map[target_padded.split(":")[0] + ":"]
-            config_file = os.path.join(disk_path, f"{target_padded.replace(':', '_')}.json")
+            config_file = self._config_file(target_padded)
+            self._disk_cache[config_file] = final_val
+            self._dirty.add(config_file)
+
+    def _flush_disk(self):
+        """把缓存中改动过的磁盘值写回配置文件（每个文件只 open 一次、整体 write 一次）"""
+        for config_file in self._dirty:
+            data = _json_dumps({"value": self._disk_cache[config_file]})
             with open(config_file, "w") as f:
-                json.dump({"value": final_val}, f)
+                f.write(data)
+        self._dirty.clear()
 
     def parse_sjxeaflist(self, params: List[str]):
         """解析启动/关机参数"""
@@ -103,96 +210,160 @@ class PomPovEditor:
             print(f"循环初始化：{target} 执行操作 {op_str} → 净操作 {net_op}")
         print(f"循环终止条件：P02M81 的值 == {self.terminate_constant}")
 
+    def _preparse_body(self, body: List[str]) -> List[Tuple[str, object, int, Optional[str]]]:
+        """预解析循环体：每行只解析一次，得到 (类型, 目标地址, 操作数, 操作串)"""
+        ops = []
+        for line in body:
+            line = line.strip().upper()  # 统一转为大写
+            if not line:
+                continue
+
+            if line.startswith("U -A"):
+                target = line.split("S ")[1].split(":")[0]
+                offset = int(line.split("CXBA ")[1].split("|")[0])
+                ops.append(("update_add", target, offset, None))
+
+            elif line.startswith("S "):
+                parts = line.split(" ", 2)
+                op_str = parts[2].rstrip("]")
+                ops.append(("set_dyn", self._resolve_dynamic_addr(parts[1]), self._parse_operation(op_str), op_str))
+
+            elif line.startswith("U CN"):
+                ops.append(("inc", line.split("U ")[1], 1, None))
+        return ops
+
+    def _compile_body(self, ops: List[Tuple[str, object, int, Optional[str]]]
+                      ) -> Optional[Tuple[List[int], List[str], List[int]]]:
+        """把预解析的循环体编译为操作码表（含非 P 地址时返回 None）"""
+        opcode_of = {"update_add": OP_UPDATE_ADD, "set_dyn": OP_SET, "inc": OP_INC}
+        opcodes, targets, deltas = [], [], []
+        for kind, target, delta, _ in ops:
+            for addr in (target if kind == "set_dyn" else (target,)):
+                if not addr.startswith("P"):
+                    return None
+                opcodes.append(opcode_of[kind])
+                targets.append(self._pad_address(addr))
+                deltas.append(delta)
+        return opcodes, targets, deltas
+
     def parse_loop_body(self, body: List[str]):
         """解析循环体"""
         print("\n=== 开始循环执行 ===")
+        ops = self._preparse_body(body)
+        compiled = self._compile_body(ops) if self.loop_running else None
+        if compiled is not None:
+            solved = _solve_loop(*compiled, self._read_mem, self._pad_address("P2M81"), self.terminate_constant)
+            if solved is None:
+                self.loop_running = False
+                raise ValueError(f"循环无法终止：P02M81 永远达不到终止常量 {self.terminate_constant}")
+
+        if compiled is not None and not self.verbose:
+            self.loop_running = False
+            loop_count, result = solved
+            for addr, value in result.items():
+                self._mem[self._mem_index(addr)] = value
+            p2m81_val = self._get_target_value("P2M81")
+            print(f"\n循环终止：P02M81 = {p2m81_val} 达到终止常量 {self.terminate_constant}（共 {loop_count} 次）")
+            return
+
+        verbose = self.verbose  # 逐次打印只在 verbose 模式下进行
+        term = self.terminate_constant
+        p2m81_key = self._pad_address("P2M81")
+        addr_to_idx, mem = self._addr_to_idx, self._mem
         loop_count = 0
         while self.loop_running:
             loop_count += 1
-            print(f"\n--- 循环第 {loop_count} 次 ---")
-
-            for line in body:
-                line = line.strip().upper()  # 统一转为大写
-                if not line:
-                    continue
+            if verbose:
+                print(f"\n--- 循环第 {loop_count} 次 ---")
 
-                if line.startswith("U -A"):
-                    target = line.split("S ")[1].split(":")[0]
-                    offset = int(line.split("CXBA ")[1].split("|")[0])
-                    self._set_target_value(target, offset, is_update=True)
-                    print(f"更新算术操作：{target}（补2位+偏移{offset}）→ 当前值 {self._get_target_value(target)}")
+            for kind, target, net_op, op_str in ops:
+                if kind == "update_add":
+                    self._set_target_value(target, net_op, is_update=True)
+                    if verbose:
+                        print(f"更新算术操作：{target}（补2位+偏移{net_op}）→ 当前值 {self._get_target_value(target)}")
 
-                elif line.startswith("S "):
-                    parts = line.split(" ", 2)
-                    target = parts[1]
-                    op_str = parts[2].rstrip("]")
-                    net_op = self._parse_operation(op_str)
-                    dynamic_addrs = self._resolve_dynamic_addr(target)
-                    for addr in dynamic_addrs:
+                elif kind == "set_dyn":
+                    for addr in target:
                         self._set_target_value(addr, net_op)
-                        print(f"设置操作：{addr} 执行 {op_str} → 净操作 {net_op} → 当前值 {self._get_target_value(addr)}")
+                        if verbose:
+                            print(f"设置操作：{addr} 执行 {op_str} → 净操作 {net_op} → 当前值 {self._get_target_value(addr)}")
 
-                elif line.startswith("U CN"):
-                    target = line.split("U ")[1]
+                else:  # inc
                     current_val = self._get_target_value(target)
                     self._set_target_value(target, current_val + 1)
-                    print(f"更新核心标识：{target} → 当前值 {self._get_target_value(target)}")
+                    if verbose:
+                        print(f"更新核心标识：{target} → 当前值 {self._get_target_value(target)}")
 
-            p2m81_val = self._get_target_value("P2M81")
-            if p2m81_val >= self.terminate_constant:
+            idx = addr_to_idx.get(p2m81_key)
+            p2m81_val = 0 if idx is None else mem[idx]
+            if p2m81_val >= term:
                 self.loop_running = False
-                print(f"\n循环终止：P02M81 = {p2m81_val} 达到终止常量 {self.terminate_constant}")
+                print(f"\n循环终止：P02M81 = {p2m81_val} 达到终止常量 {term}")
 
     def shutdown(self):
         """关机：回收资源"""
         print("\n=== 关机：回收资源 ===")
-        self.editor_memory.clear()
+        self._flush_disk()
+        self._mem.clear()
+        self._addr_to_idx.clear()
         print("已清空编辑器内存")
         for path in self.disk_map.values():
+            if not os.path.exists(path):  # 程序出错时磁盘目录可能尚未创建
+                continue
             for file in os.listdir(path):
                 os.remove(os.path.join(path, file))
             os.rmdir(path)
+        self._disk_cache.clear()
         print("已删除磁盘配置文件，释放资源")
 
+    def _scan_program(self, program: List[str]) -> List[Tuple[str, object]]:
+        """预扫描程序，得到按顺序执行的事件列表 [(类型, 内容)]"""
+        events = []
+        loop_body = None
+        for line in program:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith("SJXEAF LIST"):
+                events.append(("sjxeaflist", line.split(" ")[1:]))
+
+            elif line.startswith("KAJ"):
+                events.append(("kaj", line))
+
+            elif line == ":COD -|":
+                if loop_body is None:
+                    loop_body = []
+
+            elif line == "|-]":
+                if loop_body is not None:
+                    events.append(("cod_block", loop_body))
+                    loop_body = None
+
+            elif loop_body is not None:
+                loop_body.append(line)
+
+            elif line.startswith("S "):
+                events.append(("set", line))
+        return events
+
     def run_program(self, program: List[str]):
         """运行自定义汇编程序"""
         print("=== PomPov 编辑器启动 ===")
-        loop_header = ""
-        loop_body = []
-        in_loop = False
-        in_loop_body = False
-
         try:
-            for line in program:
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith("SJXEAF LIST"):
-                    params = line.split(" ")[1:]
-                    self.parse_sjxeaflist(params)
-
-                elif line.startswith("KAJ"):
-                    loop_header = line
-                    self.parse_loop_header(loop_header)
-                    in_loop = True
-
-                elif line == ":COD -|":
-                    in_loop_body = True
-
-                elif line == "|-]":
-                    if in_loop_body:
-                        in_loop_body = False
-                        self.loop_running = True
-                        self.parse_loop_body(loop_body)
-                        loop_body = []
-                    in_loop = False
-
-                elif in_loop_body:
-                    loop_body.append(line)
-
-                elif line.startswith("S "):
-                    parts = line.split(" ", 2)
+            for kind, payload in self._scan_program(program):
+                if kind == "sjxeaflist":
+                    self.parse_sjxeaflist(payload)
+
+                elif kind == "kaj":
+                    self.parse_loop_header(payload)
+
+                elif kind == "cod_block":
+                    self.loop_running = True
+                    self.parse_loop_body(payload)
+
+                else:
+                    parts = payload.split(" ", 2)
                     target = parts[1]
                     op_str = parts[2].rstrip("]")
                     net_op = self._parse_operation(op_str)